@@ -34,5 +34,11 @@ def read_root():
 def health_check():
     return {"status": "healthy", "service": "mawell-assistant"}
 
+@app.get("/health/llm")
+def llm_health_check(probe: bool = False):
+    # Métricas por backend del pool LLM; con ?probe=true ejecuta antes el health-check
+    from app.services.llm_service import check_backends, get_backend_metrics
+    return {"backends": check_backends() if probe else get_backend_metrics()}
+
 
 app.include_router(chat_router)
\ No newline at end of file
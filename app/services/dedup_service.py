@@ -0,0 +1,121 @@
+# /services/dedup_service.py
+
+import os
+import re
+
+# Similitud de Jaccard (sobre shingles de palabras) a partir de la cual dos chunks son casi duplicados.
+# Con pocos cientos de chunks se calcula exacta en vez de estimarla con MinHash.
+# Con 0.88 el docs.pkl incluido pasa de 254 a 244 fragmentos (misma respuesta con la pregunta
+# reformulada); desde ~0.86 empiezan a fusionarse fichas de equipos distintos.
+DEDUP_JACCARD_THRESHOLD = float(os.getenv("DEDUP_JACCARD_THRESHOLD", "0.88"))
+SHINGLE_SIZE = 3
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin puntuación y con espacios colapsados."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def shingles(normalized: str) -> frozenset:
+    """Conjunto de shingles de SHINGLE_SIZE palabras del texto normalizado."""
+    words = normalized.split()
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([" ".join(words)]) if words else frozenset()
+    return frozenset(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def doc_text(doc) -> str:
+    return doc.get('text', str(doc)) if isinstance(doc, dict) else str(doc)
+
+
+def doc_sources(doc):
+    return list(doc.get('sources', [])) if isinstance(doc, dict) else []
+
+
+def make_doc(text: str, sources) -> dict:
+    """Documento canónico: el texto del chunk y la lista de fuentes donde aparece."""
+    return {'text': text, 'sources': [s for s in sources if s]}
+
+
+def dedupe_positions(candidates, existing_docs):
+    """
+    Filtra los candidatos que ya están en existing_docs (o repetidos en el propio lote),
+    por texto normalizado idéntico o por similitud de Jaccard >= DEDUP_JACCARD_THRESHOLD.
+    Los candidatos sin texto se descartan y se cuentan aparte como vacíos.
+
+    Las fuentes de cada duplicado se añaden a su copia canónica, que se reemplaza en
+    existing_docs por un dict {'text', 'sources'} si era un string. Devuelve las
+    posiciones de los candidatos conservados, los documentos nuevos a indexar (en el
+    mismo orden) y un resumen con los conteos.
+    """
+    exact = {}
+    fingerprints = []
+    for position, doc in enumerate(existing_docs):
+        normalized = normalize_text(doc_text(doc))
+        exact.setdefault(normalized, ('existing', position))
+        fingerprints.append((shingles(normalized), ('existing', position)))
+
+    positions = []
+    new_docs = []
+    stats = {"total": len(candidates), "exact": 0, "near": 0, "empty": 0, "kept": 0}
+    for candidate_position, candidate in enumerate(candidates):
+        normalized = normalize_text(doc_text(candidate))
+        if not normalized:
+            stats["empty"] += 1
+            continue
+
+        match = exact.get(normalized)
+        fingerprint = shingles(normalized)
+        if match:
+            stats["exact"] += 1
+        else:
+            match = next(
+                (ref for other, ref in fingerprints if _jaccard(fingerprint, other) >= DEDUP_JACCARD_THRESHOLD),
+                None,
+            )
+            if match:
+                stats["near"] += 1
+
+        if match:
+            target, position = match
+            docs = existing_docs if target == 'existing' else new_docs
+            canonical = docs[position]
+            sources = doc_sources(canonical)
+            for source in doc_sources(candidate):
+                if source not in sources:
+                    sources.append(source)
+            docs[position] = make_doc(doc_text(canonical), sources)
+            continue
+
+        ref = ('new', len(new_docs))
+        positions.append(candidate_position)
+        new_docs.append(candidate if isinstance(candidate, dict) else make_doc(candidate, []))
+        exact[normalized] = ref
+        fingerprints.append((fingerprint, ref))
+
+    stats["kept"] = len(new_docs)
+    return positions, new_docs, stats
+
+
+def empty_stats() -> dict:
+    return {"total": 0, "exact": 0, "near": 0, "empty": 0, "kept": 0}
+
+
+def add_stats(totals: dict, stats: dict) -> dict:
+    for key in totals:
+        totals[key] += stats.get(key, 0)
+    return totals
+
+
+def format_dedup_report(stats: dict) -> str:
+    removed = stats["total"] - stats["kept"]
+    ratio = removed / stats["total"] * 100 if stats["total"] else 0
+    return (f"🧹 Dedup: {stats['total']} fragmentos → {stats['kept']} nuevos "
+            f"({stats['exact']} exactos, {stats['near']} casi duplicados, {stats['empty']} vacíos, -{ratio:.0f}%)")
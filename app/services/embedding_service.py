@@ -3,16 +3,20 @@
 import os
 import pickle
 
-# Configuración de archivos
-INDEX_FILE = "data/vector_db/index.faiss"
-DOC_FILE = "data/vector_db/docs.pkl"
+from app.services.dedup_service import dedupe_positions, format_dedup_report, make_doc, normalize_text
+from app.services.shard_service import add_to_shard, categorize_source, categorize_text, check_shard
+
+# Configuración de archivos y modelo (los mismos que usa ia_service para las consultas)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+INDEX_FILE = os.getenv("VECTOR_DB_INDEX", "data/vector_db/index.faiss")
+DOC_FILE = os.getenv("VECTOR_DB_DOCS", "data/vector_db/docs.pkl")
 
 # Modelo se inicializa solo si está disponible
 MODEL = None
 try:
     from sentence_transformers import SentenceTransformer
-    MODEL = SentenceTransformer("distiluse-base-multilingual-cased-v1")  # Español incluido
-    print("✅ Embedding model loaded successfully")
+    MODEL = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    print(f"✅ Embedding model '{EMBEDDING_MODEL_NAME}' loaded successfully")
 except ImportError:
     print("⚠️  sentence_transformers not available. Embedding service disabled.")
 except Exception as e:
@@ -71,48 +75,116 @@ def load_or_create_index(embedding_dim):
 
 # Función para actualizar el índice con nuevos PDFs
 def build_vector_index(pdf_path: str):
+    """
+    Añade un PDF al índice plano y al shard de su categoría, descartando duplicados
+    en cada uno. Devuelve el resumen de deduplicación del índice plano
+    (ver dedupe_positions) o None si no se pudo construir.
+    """
     if not MODEL:
         print("❌ No embedding model available. Cannot build vector index.")
-        return False
+        return None
     
     try:
         import faiss
         text = extract_text_from_pdf(pdf_path)
         chunks = chunk_text(text)
-        embeddings = MODEL.encode(chunks)
-
-        # Obtén la dimensión de los embeddings
-        embedding_dim = embeddings.shape[1]
+        source = os.path.basename(pdf_path)
 
-        # Cargar el índice existente o crear uno nuevo
-        index = load_or_create_index(embedding_dim)
-        if not index:
-            return False
-
-        # Añadir los nuevos embeddings al índice
-        index.add(embeddings)
-
-        # Guardar el índice actualizado
-        os.makedirs("data/vector_db", exist_ok=True)
-        faiss.write_index(index, INDEX_FILE)
-
-        # Guardar los chunks en un archivo
+        # Cargar los chunks existentes para descartar duplicados
         if os.path.exists(DOC_FILE):
             with open(DOC_FILE, "rb") as f:
                 existing_chunks = pickle.load(f)
         else:
             existing_chunks = []
 
-        existing_chunks.extend(chunks)
+        positions, new_docs, stats = dedupe_positions([make_doc(chunk, [source]) for chunk in chunks], existing_chunks)
+        print(format_dedup_report(stats))
+
+        # Un solo encode por PDF: el índice plano y el shard filtran sus propios duplicados
+        embeddings = MODEL.encode(chunks) if chunks else None
 
+        # Comprobar el shard antes de tocar el índice plano, para no dejar uno actualizado y el otro no
+        category = None
+        if any(normalize_text(chunk) for chunk in chunks):
+            category = categorize_source(pdf_path) or categorize_text(text)
+            check_shard(category, embeddings.shape[1], EMBEDDING_MODEL_NAME)
+
+        if new_docs:
+            new_embeddings = embeddings[positions]
+
+            # Obtén la dimensión de los embeddings
+            embedding_dim = new_embeddings.shape[1]
+
+            # Cargar el índice existente o crear uno nuevo
+            index = load_or_create_index(embedding_dim)
+            if not index:
+                return None
+
+            # Añadir los nuevos embeddings al índice
+            index.add(new_embeddings)
+
+            # Guardar el índice actualizado
+            os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
+            faiss.write_index(index, INDEX_FILE)
+
+            existing_chunks.extend(new_docs)
+
+        # Guardar los chunks (también los duplicados actualizan las fuentes de su copia canónica)
+        os.makedirs(os.path.dirname(DOC_FILE), exist_ok=True)
         with open(DOC_FILE, "wb") as f:
             pickle.dump(existing_chunks, f)
 
-        print(f"✅ Vector DB actualizada con {len(chunks)} fragmentos. Total de fragmentos: {len(existing_chunks)}")
-        return True
+        print(f"✅ Vector DB actualizada con {len(new_docs)} fragmentos. Total de fragmentos: {len(existing_chunks)}")
+
+        # Guardar también en el shard de su categoría (por nombre del PDF o por contenido).
+        # El shard deduplica contra sus propios chunks: un duplicado de otra categoría sigue
+        # llegando a este shard, y un duplicado de la misma actualiza las fuentes de su copia.
+        # El índice plano ya cambió: se devuelve su resumen aunque falle el shard.
+        if category:
+            try:
+                add_to_shard(category, [make_doc(chunk, [source]) for chunk in chunks], embeddings, EMBEDDING_MODEL_NAME)
+            except Exception as e:
+                print(f"❌ Error actualizando el shard '{category}': {e}")
+
+        return stats
     except ImportError:
         print("❌ FAISS not available. Cannot build vector index.")
-        return False
+        return None
     except Exception as e:
         print(f"❌ Error building vector index: {e}")
-        return False
+        return None
+
+
+def dedupe_vector_index():
+    """
+    Elimina los duplicados del índice plano ya construido (index.faiss + docs.pkl)
+    reutilizando sus vectores, sin volver a generar embeddings. Devuelve el resumen
+    de deduplicación o None si no se pudo.
+    """
+    try:
+        import faiss
+        if not (os.path.exists(INDEX_FILE) and os.path.exists(DOC_FILE)):
+            print("❌ No vector database available to dedupe.")
+            return None
+
+        index = faiss.read_index(INDEX_FILE)
+        with open(DOC_FILE, "rb") as f:
+            docs = pickle.load(f)
+        if index.ntotal != len(docs):
+            print(f"❌ index.faiss ({index.ntotal}) y docs.pkl ({len(docs)}) no coinciden. Reconstruir con scripts.create_index.")
+            return None
+
+        positions, kept_docs, stats = dedupe_positions(docs, [])
+        deduped = faiss.IndexFlatL2(index.d)
+        if positions:
+            deduped.add(index.reconstruct_n(0, index.ntotal)[positions])
+
+        faiss.write_index(deduped, INDEX_FILE)
+        with open(DOC_FILE, "wb") as f:
+            pickle.dump(kept_docs, f)
+
+        print(format_dedup_report(stats))
+        return stats
+    except ImportError:
+        print("❌ FAISS not available. Cannot dedupe vector index.")
+        return None
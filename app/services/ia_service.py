@@ -1,8 +1,11 @@
 import os
-import requests
 import pickle
 from dotenv import load_dotenv
 
+from app.services.dedup_service import doc_text
+from app.services.llm_service import generate
+from app.services.shard_service import list_shards, load_shard, route_query, search_shards
+
 load_dotenv()
 
 # Config from .env with defaults
@@ -10,10 +13,6 @@ EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
 INDEX_FILE = os.getenv("VECTOR_DB_INDEX", "data/vector_db/index.faiss")
 DOC_FILE = os.getenv("VECTOR_DB_DOCS", "data/vector_db/docs.pkl")
 
-# Use external Ollama service or fallback
-OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
-OLLAMA_MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME", "mistral")
-
 # Fallback mode when dependencies are not available
 FALLBACK_MODE = os.getenv("FALLBACK_MODE", "true").lower() == "true"
 
@@ -32,6 +31,9 @@ except Exception as e:
     print("⚠️  Using fallback mode.")
     MODEL = None
 
+# Evita repetir en cada consulta el aviso de shards construidos con otro modelo
+_SHARD_MISMATCH_WARNED = False
+
 # Distance threshold: umbral más estricto para evitar respuestas irrelevantes
 MAX_DISTANCE_THRESHOLD = 0.65
 
@@ -52,8 +54,142 @@ REGLA ABSOLUTA: Si el contexto no es relevante para la pregunta sobre Mawell, NO
 """.strip()
 
 
-def get_relevant_chunks(query: str, top_k=4):
+def _has_relevant(results) -> bool:
+    # Hay contexto relevante si alguna distancia es suficientemente baja
+    return any(dist <= MAX_DISTANCE_THRESHOLD for dist, _ in results)
+
+
+def _keyword_search(query: str, docs, top_k=4):
+    """Búsqueda por palabras clave y sinónimos en una lista de fragmentos."""
+    print(f"📚 Buscando en {len(docs)} fragmentos de documentos de Mawell...")
+    
+    # Búsqueda más inteligente por keywords relevantes
+    query_lower = query.lower().strip()
+    query_words = [word for word in query_lower.split() if len(word) > 2]
+    
+    # Mapeo de sinónimos específicos de Mawell
+    synonyms = {
+        'equipos': ['equipos', 'equipo', 'maquinaria', 'dispositivos', 'aparatos'],
+        'servicios': ['servicios', 'servicio', 'mantenimiento', 'instalación', 'reparación'],
+        'bombas': ['bomba', 'bombas', 'bomba centrífuga', 'bomba dosificadora'],
+        'filtros': ['filtro', 'filtros', 'filtración', 'purificación'],
+        'agua': ['agua', 'ultrapura', 'purificación', 'tratamiento'],
+        'análisis': ['análisis', 'analizador', 'termográfico', 'detección'],
+        'industrial': ['industrial', 'industria', 'técnico', 'profesional'],
+        'mawell': ['mawell', 'empresa', 'compañía']
+    }
+    
+    # Expandir palabras de búsqueda con sinónimos
+    expanded_words = set(query_words)
+    for word in query_words:
+        for key, syns in synonyms.items():
+            if word in syns:
+                expanded_words.update(syns)
+    
+    relevant_docs = []
+    for doc in docs:
+        # Manejar formato dict o string
+        text = doc_text(doc)
+        doc_lower = text.lower()
+        score = 0
+        
+        # Verificar que el documento sea realmente sobre Mawell y no sea solo preguntas
+        mawell_indicators = ['mawell', 'equipo', 'servicio', 'industrial', 'bomba', 'filtro', 'sistema']
+        has_mawell_content = any(indicator in doc_lower for indicator in mawell_indicators)
+        
+        # Filtrar documentos que son principalmente preguntas
+        question_indicators = ['¿', '?']
+        question_count = sum(text.count(indicator) for indicator in question_indicators)
+        total_sentences = max(text.count('.') + text.count('?') + text.count('!'), 1)
+        question_ratio = question_count / total_sentences
+        
+        if not has_mawell_content or question_ratio > 0.7:  # Si más del 70% son preguntas, saltar
+            continue
+        
+        # Puntuar por coincidencias exactas de frases (más peso)
+        if query_lower in doc_lower:
+            score += 50
+        
+        # Puntuar por palabras clave importantes
+        important_matches = 0
+        for word in query_words:
+            if len(word) > 3 and word in doc_lower:  # Solo palabras importantes
+                count = doc_lower.count(word)
+                score += count * 10
+                important_matches += count
+        
+        # Puntuar por sinónimos expandidos (menos peso)
+        for word in expanded_words:
+            if word not in query_words:  # Solo sinónimos adicionales
+                count = doc_lower.count(word)
+                score += count * 3
+        
+        # Bonus para títulos/encabezados con palabras clave
+        header_text = text[:150].lower()
+        for word in query_words:
+            if word in header_text:
+                score += 15
+        
+        # Requerir al menos 2 coincidencias importantes o una coincidencia exacta
+        if score >= 20 and (important_matches >= 2 or query_lower in doc_lower):
+            relevant_docs.append((text, score))
+    
+    # Ordenar por relevancia y tomar solo los más relevantes
+    if relevant_docs:
+        relevant_docs.sort(key=lambda x: x[1], reverse=True)
+        # Filtrar solo documentos con alta puntuación
+        high_score_docs = [(doc, score) for doc, score in relevant_docs if score >= 30]
+        
+        if high_score_docs:
+            best_docs = [doc for doc, score in high_score_docs[:top_k]]
+            print(f"✅ Encontrados {len(best_docs)} fragmentos altamente relevantes (scores: {[score for _, score in high_score_docs[:top_k]]})")
+            return best_docs
+    
+    print("⚠️ No se encontraron fragmentos relevantes")
+    return None
+
+
+def _shard_docs(categories):
+    docs = []
+    for category in categories:
+        docs.extend(load_shard(category)[1])
+    return docs
+
+
+def get_relevant_chunks(query: str, top_k=4, fanout=False):
+    """
+    Recupera los fragmentos más relevantes. Si existen shards por categoría, solo se
+    buscan los que elige el router (o todos con fanout=True), y se reintenta en todos
+    solo si el router eligió un subconjunto sin resultados; si no, el índice plano.
+    """
     try:
+        shards = list_shards()
+
+        # Búsqueda vectorial por shards: el coste depende del tamaño de los shards elegidos
+        if MODEL and shards:
+            try:
+                query_vec = MODEL.encode([query])
+                categories = route_query(query, query_vec, fanout=fanout)
+                results = search_shards(query_vec, categories, top_k)
+                # Si el router eligió un subconjunto sin resultados relevantes, reintentar en
+                # todos los shards reutilizando el vector de la consulta
+                if not _has_relevant(results) and len(categories) < len(shards):
+                    categories = shards
+                    results = search_shards(query_vec, categories, top_k)
+                if results:
+                    print(f"🗂️  Shards consultados: {categories}")
+                    if not _has_relevant(results):
+                        return None
+                    return [doc_text(doc) for _, doc in results]
+            except ImportError:
+                print("⚠️  FAISS not available, using fallback")
+            except ValueError:
+                # Se avisa una sola vez: el desajuste se reporta al construir los shards
+                global _SHARD_MISMATCH_WARNED
+                if not _SHARD_MISMATCH_WARNED:
+                    print(f"⚠️  Shards incompatibles con '{EMBEDDING_MODEL_NAME}', usando fallback. Reconstruir con scripts.create_shards")
+                    _SHARD_MISMATCH_WARNED = True
+
         # Try to use vector search if available
         if MODEL and os.path.exists(INDEX_FILE) and os.path.exists(DOC_FILE):
             try:
@@ -75,102 +211,24 @@ def get_relevant_chunks(query: str, top_k=4):
                 if all(dist > MAX_DISTANCE_THRESHOLD for dist in distances[0]):
                     return None
 
-                return [docs[i] for i in indices[0]]
+                return [doc_text(docs[i]) for i in indices[0]]
             except ImportError:
                 print("⚠️  FAISS not available, using fallback")
         
         # Fallback: búsqueda inteligente en docs de Mawell
-        if os.path.exists(DOC_FILE):
+        if shards or os.path.exists(DOC_FILE):
             try:
+                if shards:
+                    categories = route_query(query, fanout=fanout)
+                    result = _keyword_search(query, _shard_docs(categories), top_k)
+                    # Si el router eligió un subconjunto y no hubo resultados, reintentar en todos
+                    if not result and len(categories) < len(shards):
+                        result = _keyword_search(query, _shard_docs(shards), top_k)
+                    return result
+
                 with open(DOC_FILE, "rb") as f:
                     docs = pickle.load(f)
-                
-                print(f"📚 Buscando en {len(docs)} fragmentos de documentos de Mawell...")
-                
-                # Búsqueda más inteligente por keywords relevantes
-                query_lower = query.lower().strip()
-                query_words = [word for word in query_lower.split() if len(word) > 2]
-                
-                # Mapeo de sinónimos específicos de Mawell
-                synonyms = {
-                    'equipos': ['equipos', 'equipo', 'maquinaria', 'dispositivos', 'aparatos'],
-                    'servicios': ['servicios', 'servicio', 'mantenimiento', 'instalación', 'reparación'],
-                    'bombas': ['bomba', 'bombas', 'bomba centrífuga', 'bomba dosificadora'],
-                    'filtros': ['filtro', 'filtros', 'filtración', 'purificación'],
-                    'agua': ['agua', 'ultrapura', 'purificación', 'tratamiento'],
-                    'análisis': ['análisis', 'analizador', 'termográfico', 'detección'],
-                    'industrial': ['industrial', 'industria', 'técnico', 'profesional'],
-                    'mawell': ['mawell', 'empresa', 'compañía']
-                }
-                
-                # Expandir palabras de búsqueda con sinónimos
-                expanded_words = set(query_words)
-                for word in query_words:
-                    for key, syns in synonyms.items():
-                        if word in syns:
-                            expanded_words.update(syns)
-                
-                relevant_docs = []
-                for doc in docs:
-                    # Manejar formato dict o string
-                    doc_text = doc.get('text', str(doc)) if isinstance(doc, dict) else str(doc)
-                    doc_lower = doc_text.lower()
-                    score = 0
-                    
-                    # Verificar que el documento sea realmente sobre Mawell y no sea solo preguntas
-                    mawell_indicators = ['mawell', 'equipo', 'servicio', 'industrial', 'bomba', 'filtro', 'sistema']
-                    has_mawell_content = any(indicator in doc_lower for indicator in mawell_indicators)
-                    
-                    # Filtrar documentos que son principalmente preguntas
-                    question_indicators = ['¿', '?']
-                    question_count = sum(doc_text.count(indicator) for indicator in question_indicators)
-                    total_sentences = max(doc_text.count('.') + doc_text.count('?') + doc_text.count('!'), 1)
-                    question_ratio = question_count / total_sentences
-                    
-                    if not has_mawell_content or question_ratio > 0.7:  # Si más del 70% son preguntas, saltar
-                        continue
-                    
-                    # Puntuar por coincidencias exactas de frases (más peso)
-                    if query_lower in doc_lower:
-                        score += 50
-                    
-                    # Puntuar por palabras clave importantes
-                    important_matches = 0
-                    for word in query_words:
-                        if len(word) > 3 and word in doc_lower:  # Solo palabras importantes
-                            count = doc_lower.count(word)
-                            score += count * 10
-                            important_matches += count
-                    
-                    # Puntuar por sinónimos expandidos (menos peso)
-                    for word in expanded_words:
-                        if word not in query_words:  # Solo sinónimos adicionales
-                            count = doc_lower.count(word)
-                            score += count * 3
-                    
-                    # Bonus para títulos/encabezados con palabras clave
-                    header_text = doc_text[:150].lower()
-                    for word in query_words:
-                        if word in header_text:
-                            score += 15
-                    
-                    # Requerir al menos 2 coincidencias importantes o una coincidencia exacta
-                    if score >= 20 and (important_matches >= 2 or query_lower in doc_lower):
-                        relevant_docs.append((doc_text, score))
-                
-                # Ordenar por relevancia y tomar solo los más relevantes
-                if relevant_docs:
-                    relevant_docs.sort(key=lambda x: x[1], reverse=True)
-                    # Filtrar solo documentos con alta puntuación
-                    high_score_docs = [(doc, score) for doc, score in relevant_docs if score >= 30]
-                    
-                    if high_score_docs:
-                        best_docs = [doc for doc, score in high_score_docs[:top_k]]
-                        print(f"✅ Encontrados {len(best_docs)} fragmentos altamente relevantes (scores: {[score for _, score in high_score_docs[:top_k]]})")
-                        return best_docs
-                
-                print("⚠️ No se encontraron fragmentos relevantes")
-                return None
+                return _keyword_search(query, docs, top_k)
             except Exception as e:
                 print(f"❌ Error leyendo documentos: {e}")
                 pass
@@ -186,7 +244,7 @@ def get_relevant_chunks(query: str, top_k=4):
                     docs = pickle.load(f)
                 print(f"📚 Usando búsqueda por palabras clave con {len(docs)} documentos...")
                 # Devolver algunos documentos como fallback
-                return docs[:2] if len(docs) >= 2 else docs
+                return [doc_text(doc) for doc in docs[:2]]
         except Exception as fallback_error:
             print(f"❌ Error accediendo a documentos: {fallback_error}")
         return None
@@ -249,31 +307,23 @@ INSTRUCCIÓN: Basándote en el contexto proporcionado, responde la pregunta del
 
 RESPUESTA:"""
 
-        response = requests.post(
-            OLLAMA_API_URL, 
-            json={
-                "model": OLLAMA_MODEL_NAME,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "max_tokens": 500
-                }
+        # El router elige el backend del pool con menos carga
+        answer = generate(
+            full_prompt,
+            options={
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "max_tokens": 500
             },
             timeout=100 # Timeout un poco más largo para respuestas elaboradas
         )
 
-        if response.status_code == 200:
-            answer = response.json().get("response", "").strip()
-            # Validar que la respuesta no sea solo el contexto copiado
-            if len(answer) > 50 and not _is_mostly_copied_text(answer, context):
-                return {
-                    "question": query,
-                    "answer": answer
-                }
-        else:
-            raise Exception(f"Ollama error: {response.status_code}")
+        # Validar que la respuesta no sea solo el contexto copiado
+        if len(answer) > 50 and not _is_mostly_copied_text(answer, context):
+            return {
+                "question": query,
+                "answer": answer
+            }
             
     except Exception as e:
         print(f"⚠️ Ollama no disponible, usando generador de respuestas inteligente: {e}")
@@ -0,0 +1,274 @@
+# /services/llm_service.py
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Un solo backend por defecto (compatibilidad con OLLAMA_API_URL / OLLAMA_MODEL_NAME)
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME", "mistral")
+# Concurrencia máxima del backend por defecto; 0 = sin límite (como una llamada directa a Ollama)
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "0"))
+
+# Pool de backends: "url|modelo|max_concurrencia" separados por comas (concurrencia vacía o 0 = sin límite).
+# Ej: LLM_BACKENDS=http://gpu1:11434/api/generate|mistral|4,http://gpu2:11434/api/generate|llama3|2
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+
+# Fallos consecutivos (generación o health-check) antes de sacar un backend de rotación
+LLM_BACKEND_MAX_FAILURES = int(os.getenv("LLM_BACKEND_MAX_FAILURES", "3"))
+# Segundos fuera de rotación antes de volver a probarlo
+LLM_BACKEND_COOLDOWN = float(os.getenv("LLM_BACKEND_COOLDOWN", "30"))
+# Cada cuántos segundos el hilo de health-check prueba los backends. Con 0 no hay hilo: pasado
+# el cooldown, un backend fuera de rotación recibe una petición de prueba (half-open)
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))
+# Segundos máximos esperando un hueco cuando todos los backends están a su máxima concurrencia
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Peso de la última latencia en la media móvil exponencial
+LATENCY_EWMA_ALPHA = 0.3
+# Latencia asumida (segundos) para un backend que aún no ha respondido
+DEFAULT_LATENCY = 1.0
+
+
+class LLMBackend:
+    """Un servidor Ollama del pool con sus métricas de uso."""
+
+    def __init__(self, url: str, model: str, max_concurrency: int = 0):
+        self.url = url
+        self.model = model
+        # None = sin límite de peticiones simultáneas
+        self.max_concurrency = max_concurrency if max_concurrency and max_concurrency > 0 else None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.health_failures = 0
+        self.queue_timeouts = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.healthy = True
+        self.retry_at = 0.0
+
+    @property
+    def health_url(self) -> str:
+        parts = urlsplit(self.url)
+        return f"{parts.scheme}://{parts.netloc}/api/tags"
+
+    def has_capacity(self) -> bool:
+        return self.max_concurrency is None or self.in_flight < self.max_concurrency
+
+    def score(self) -> float:
+        """Menor es mejor: peticiones en curso ponderadas por la latencia reciente."""
+        return (self.in_flight + 1) * (self.latency or DEFAULT_LATENCY)
+
+    def metrics(self) -> dict:
+        return {
+            "url": self.url,
+            "model": self.model,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "health_failures": self.health_failures,
+            "queue_timeouts": self.queue_timeouts,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+        }
+
+
+def parse_backends(spec: str):
+    """Convierte "url|modelo|max_concurrencia,..." en una lista de LLMBackend."""
+    backends = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = [part.strip() for part in entry.split("|")]
+        url = parts[0]
+        model = parts[1] if len(parts) > 1 and parts[1] else OLLAMA_MODEL_NAME
+        max_concurrency = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+        backends.append(LLMBackend(url, model, max_concurrency))
+    return backends
+
+
+BACKENDS = parse_backends(LLM_BACKENDS) or [LLMBackend(OLLAMA_API_URL, OLLAMA_MODEL_NAME, OLLAMA_MAX_CONCURRENCY)]
+
+# Protege el estado de todos los backends; se notifica cada vez que se libera un hueco
+_lock = threading.Condition()
+
+
+def _record_failure(backend: LLMBackend, probe: bool = False):
+    # Los fallos de health-check se cuentan aparte de los errores de generación
+    if probe:
+        backend.health_failures += 1
+    else:
+        backend.errors += 1
+    backend.consecutive_failures += 1
+    if backend.consecutive_failures >= LLM_BACKEND_MAX_FAILURES:
+        if backend.healthy:
+            print(f"⚠️  Backend LLM {backend.url} fuera de rotación tras {backend.consecutive_failures} fallos")
+        backend.healthy = False
+        backend.retry_at = time.monotonic() + LLM_BACKEND_COOLDOWN
+
+
+def _record_success(backend: LLMBackend, latency: float = None):
+    if not backend.healthy:
+        print(f"✅ Backend LLM {backend.url} de vuelta en rotación")
+    backend.healthy = True
+    backend.consecutive_failures = 0
+    if latency is not None:
+        if backend.latency is None:
+            backend.latency = latency
+        else:
+            backend.latency = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * backend.latency
+
+
+def check_backend(backend: LLMBackend, timeout: float = 5) -> bool:
+    """Health-check contra /api/tags de Ollama. Actualiza el estado del backend."""
+    try:
+        ok = requests.get(backend.health_url, timeout=timeout).status_code == 200
+    except Exception:
+        ok = False
+    with _lock:
+        if ok:
+            _record_success(backend)
+        else:
+            _record_failure(backend, probe=True)
+        _lock.notify_all()
+    return ok
+
+
+def check_backends():
+    """Ejecuta el health-check de todos los backends y devuelve sus métricas."""
+    for backend in BACKENDS:
+        check_backend(backend)
+    return get_backend_metrics()
+
+
+def _health_loop():
+    # Fuera del camino de las peticiones: prueba los backends sanos y, cuando termina
+    # su cooldown, los que están fuera de rotación (que solo vuelven si pasan el check)
+    while True:
+        time.sleep(LLM_HEALTH_INTERVAL)
+        now = time.monotonic()
+        with _lock:
+            due = [b for b in BACKENDS if b.healthy or b.retry_at <= now]
+        for backend in due:
+            check_backend(backend)
+
+
+_health_thread = None
+
+
+def start_health_checks():
+    """Arranca (una sola vez) el hilo de health-check en segundo plano."""
+    global _health_thread
+    if LLM_HEALTH_INTERVAL <= 0:
+        return
+    with _lock:
+        if _health_thread is None:
+            _health_thread = threading.Thread(target=_health_loop, name="llm-health", daemon=True)
+            _health_thread.start()
+
+
+def _acquire_backend(exclude=()):
+    """
+    Reserva el backend sano con menor (en curso + 1) * latencia. Si todos están al
+    máximo de concurrencia espera hasta LLM_QUEUE_TIMEOUT; devuelve None si no hay ninguno.
+    Sin hilo de health-check, antes prueba (half-open) los backends con el cooldown cumplido.
+    """
+    start_health_checks()
+    deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+    with _lock:
+        while True:
+            now = time.monotonic()
+            candidates = [b for b in BACKENDS if b.healthy and b not in exclude]
+            # Sin hilo de health-check, los backends con el cooldown cumplido entran a prueba
+            trial = [] if LLM_HEALTH_INTERVAL > 0 else [
+                b for b in BACKENDS
+                if not b.healthy and b.retry_at <= now and b not in exclude and b.has_capacity()
+            ]
+            if trial:
+                # Una sola petición de prueba por cooldown; si falla, generate() reintenta en
+                # otro backend y _record_failure lo vuelve a aplazar
+                backend = trial[0]
+                backend.retry_at = now + LLM_BACKEND_COOLDOWN
+                backend.in_flight += 1
+                backend.requests += 1
+                return backend
+            if not candidates:
+                return None
+            available = [b for b in candidates if b.has_capacity()]
+            if available:
+                backend = min(available, key=lambda b: b.score())
+                backend.in_flight += 1
+                backend.requests += 1
+                return backend
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Rechazo por cola llena: se cuenta en cada backend que estaba saturado
+                for backend in candidates:
+                    backend.queue_timeouts += 1
+                return None
+            _lock.wait(remaining)
+
+
+def _release_backend(backend: LLMBackend, latency: float = None, failed: bool = False):
+    with _lock:
+        backend.in_flight -= 1
+        if failed:
+            _record_failure(backend)
+        else:
+            _record_success(backend, latency)
+        _lock.notify_all()
+
+
+def generate(prompt: str, options: dict = None, timeout: float = 100) -> str:
+    """
+    Envía el prompt al backend con menos carga. Si falla, reintenta en los demás
+    backends del pool; lanza una excepción si ninguno responde.
+    """
+    tried = []
+    last_error = None
+    while len(tried) < len(BACKENDS):
+        backend = _acquire_backend(exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend)
+
+        start = time.monotonic()
+        try:
+            response = requests.post(
+                backend.url,
+                json={
+                    "model": backend.model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": options or {},
+                },
+                timeout=timeout,
+            )
+            if response.status_code != 200:
+                raise Exception(f"Ollama error: {response.status_code}")
+            answer = response.json().get("response", "").strip()
+        except Exception as e:
+            _release_backend(backend, failed=True)
+            last_error = e
+            print(f"⚠️  Backend LLM {backend.url} falló: {e}")
+            continue
+
+        _release_backend(backend, latency=time.monotonic() - start)
+        return answer
+
+    raise Exception(f"No hay backends LLM disponibles: {last_error}")
+
+
+def get_backend_metrics():
+    """Métricas por backend: en curso, latencia, errores y estado de salud."""
+    with _lock:
+        return [backend.metrics() for backend in BACKENDS]
@@ -0,0 +1,343 @@
+# /services/shard_service.py
+
+import os
+import pickle
+import shutil
+
+from app.services.dedup_service import add_stats, dedupe_positions, doc_sources, doc_text, empty_stats
+
+# Carpeta raíz de los shards: un subdirectorio por categoría con su propio index.faiss y docs.pkl
+SHARD_DIR = os.getenv("VECTOR_DB_SHARDS", "data/vector_db/shards")
+SHARD_INDEX_NAME = "index.faiss"
+SHARD_DOCS_NAME = "docs.pkl"
+SHARD_META_NAME = "meta.pkl"
+
+# Máximo de shards a consultar por pregunta; si más shards empatan con el mejor, se consultan todos
+ROUTER_MAX_SHARDS = int(os.getenv("ROUTER_MAX_SHARDS", "2"))
+# Empate por palabras clave: puntuación >= ROUTER_FANOUT_RATIO * la mejor
+ROUTER_FANOUT_RATIO = float(os.getenv("ROUTER_FANOUT_RATIO", "0.6"))
+# Empate por centroides: similitud coseno a menos de ROUTER_CENTROID_MARGIN de la mejor
+ROUTER_CENTROID_MARGIN = float(os.getenv("ROUTER_CENTROID_MARGIN", "0.05"))
+
+DEFAULT_CATEGORY = "general"
+
+# Categorías de Mawell con sus palabras clave (usadas para clasificar chunks y enrutar consultas)
+CATEGORY_KEYWORDS = {
+    "equipos": ['equipos', 'equipo', 'maquinaria', 'dispositivos', 'aparatos', 'bomba', 'bombas',
+                'centrífuga', 'dosificadora', 'filtro', 'filtros', 'filtración', 'analizador',
+                'termográfico', 'vibracional', 'gases', 'ultrapura', 'fluidos', 'cabina'],
+    "servicios": ['servicios', 'servicio', 'mantenimiento', 'instalación', 'reparación',
+                  'calibración', 'asesoría', 'consultoría', 'capacitación'],
+    "especialidades": ['especialidades', 'especialidad', 'biológica', 'biológicas', 'biológico',
+                       'química', 'químicas', 'químico', 'microbiología', 'análisis'],
+    "laboratorio": ['laboratorio', 'reactivos', 'reactivo', 'insumos', 'material'],
+    "empresa": ['mawell', 'empresa', 'compañía', 'misión', 'visión', 'valores', 'historia',
+                'contacto', 'ubicación'],
+}
+
+# Reglas por nombre de PDF (en orden: la primera coincidencia gana)
+SOURCE_RULES = [
+    ("laboratorio", ['reactivos', 'laboratorio']),
+    ("especialidades", ['especialidades']),
+    ("empresa", ['empresa']),
+    ("servicios", ['servicios']),
+    ("equipos", ['equipo', 'equipos', 'fluidos']),
+]
+
+# Caché en memoria de los shards ya cargados: {categoria: (mtime, index, docs)}
+_SHARD_CACHE = {}
+# Caché de centroides normalizados: {categoria: (mtime, centroide)}
+_CENTROID_CACHE = {}
+
+
+def categorize_source(pdf_path: str):
+    """Devuelve la categoría de un PDF según su nombre de archivo, o None si no hay regla."""
+    name = os.path.basename(pdf_path).lower()
+    for category, keywords in SOURCE_RULES:
+        if any(keyword in name for keyword in keywords):
+            return category
+    return None
+
+
+def categorize_text(text: str) -> str:
+    """Clasifica un fragmento por conteo de palabras clave de cada categoría."""
+    scores = _keyword_scores(text)
+    best = max(scores, key=scores.get)
+    return best if scores[best] > 0 else DEFAULT_CATEGORY
+
+
+def categorize_doc(doc) -> str:
+    """Categoría de un chunk: por el nombre de su primer PDF de origen, o por su contenido."""
+    for source in doc_sources(doc):
+        category = categorize_source(source)
+        if category:
+            return category
+    return categorize_text(doc_text(doc))
+
+
+def _keyword_scores(text: str) -> dict:
+    text_lower = text.lower()
+    words = text_lower.split()
+    scores = {}
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        score = 0
+        for keyword in keywords:
+            if ' ' in keyword:
+                score += text_lower.count(keyword)
+            else:
+                score += sum(1 for word in words if word.strip('¿?¡!.,;:()') == keyword)
+        scores[category] = score
+    return scores
+
+
+def _shard_path(category: str, filename: str) -> str:
+    return os.path.join(SHARD_DIR, category, filename)
+
+
+def list_shards():
+    """Categorías que tienen un shard con fragmentos en disco."""
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(SHARD_DIR)
+        if os.path.exists(_shard_path(name, SHARD_DOCS_NAME)) and load_shard(name)[1]
+    )
+
+
+def _load_docs(category: str):
+    docs_path = _shard_path(category, SHARD_DOCS_NAME)
+    if not os.path.exists(docs_path):
+        return []
+    with open(docs_path, "rb") as f:
+        return pickle.load(f)
+
+
+def _load_meta(category: str, model_name=None):
+    meta_path = _shard_path(category, SHARD_META_NAME)
+    if not os.path.exists(meta_path):
+        return {"count": 0, "sum": None, "model": model_name}
+    with open(meta_path, "rb") as f:
+        return pickle.load(f)
+
+
+def check_shard(category: str, embedding_dim=None, model_name=None):
+    """
+    Verifica, sin escribir nada, que se pueden añadir chunks al shard: mismo modelo y
+    dimensión, índice alineado con docs.pkl, y sin mezclar shards de solo texto con
+    shards vectoriales. Lanza ValueError si no.
+    """
+    docs = _load_docs(category)
+    meta = _load_meta(category, model_name)
+    index_path = _shard_path(category, SHARD_INDEX_NAME)
+    rebuild = "Reconstruir con scripts.create_shards."
+
+    if os.path.exists(index_path):
+        if embedding_dim is None:
+            raise ValueError(f"Shard '{category}' es vectorial: no se pueden añadir chunks sin embeddings. {rebuild}")
+        import faiss
+        index = faiss.read_index(index_path)
+        if index.ntotal != len(docs):
+            raise ValueError(
+                f"Shard '{category}': index.faiss ({index.ntotal}) y docs.pkl ({len(docs)}) no coinciden. {rebuild}"
+            )
+        if meta.get("model") != model_name or index.d != embedding_dim:
+            raise ValueError(
+                f"Shard '{category}' construido con el modelo {meta.get('model')} ({index.d} dims), "
+                f"no con {model_name} ({embedding_dim} dims). {rebuild}"
+            )
+    elif docs and embedding_dim is not None:
+        raise ValueError(f"Shard '{category}' es de solo texto: no se le pueden añadir vectores. {rebuild}")
+
+
+def add_to_shard(category: str, chunks, embeddings=None, model_name=None):
+    """
+    Añade chunks (y sus embeddings, si los hay) al shard de la categoría indicada,
+    descartando los que ya están en el shard; los duplicados añaden sus fuentes a la
+    copia del shard. docs.pkl solo se escribe después de guardar sus vectores, para
+    que la posición i del índice siga correspondiendo a docs[i]. Devuelve el resumen
+    de deduplicación. Lanza ValueError si el shard no es compatible (ver check_shard).
+    """
+    check_shard(category, embeddings.shape[1] if embeddings is not None else None, model_name)
+
+    docs = _load_docs(category)
+    positions, new_docs, stats = dedupe_positions(chunks, docs)
+    if not docs and not new_docs:
+        # Nada que guardar: no crear shards vacíos
+        return stats
+
+    os.makedirs(os.path.join(SHARD_DIR, category), exist_ok=True)
+    if embeddings is not None and positions:
+        import faiss
+        embeddings = embeddings[positions]
+        index_path = _shard_path(category, SHARD_INDEX_NAME)
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+        else:
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+        index.add(embeddings)
+        faiss.write_index(index, index_path)
+
+        # Suma y conteo para el centroide que usa el router
+        meta = _load_meta(category, model_name)
+        batch_sum = embeddings.sum(axis=0)
+        meta["sum"] = batch_sum if meta["sum"] is None else meta["sum"] + batch_sum
+        meta["count"] += len(embeddings)
+        meta["model"] = model_name
+        with open(_shard_path(category, SHARD_META_NAME), "wb") as f:
+            pickle.dump(meta, f)
+
+    docs.extend(new_docs)
+    with open(_shard_path(category, SHARD_DOCS_NAME), "wb") as f:
+        pickle.dump(docs, f)
+
+    _SHARD_CACHE.pop(category, None)
+    _CENTROID_CACHE.pop(category, None)
+    print(f"🗂️  Shard '{category}' actualizado: {len(new_docs)} nuevos, {len(docs)} fragmentos")
+    return stats
+
+
+def clear_shards():
+    """Elimina todos los shards del disco y de la caché."""
+    if os.path.isdir(SHARD_DIR):
+        for name in os.listdir(SHARD_DIR):
+            path = os.path.join(SHARD_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+    _SHARD_CACHE.clear()
+    _CENTROID_CACHE.clear()
+
+
+def build_shards_from_docs(docs, model=None, model_name=None):
+    """
+    Reconstruye desde cero los shards a partir de una lista plana de chunks (p. ej. el
+    docs.pkl existente). Cada fragmento va a la categoría de su primer PDF de origen,
+    como en build_vector_index, o a la de su contenido si no tiene fuentes reconocibles.
+    Devuelve los fragmentos guardados por categoría y el resumen de deduplicación total.
+    """
+    clear_shards()
+    grouped = {}
+    for doc in docs:
+        grouped.setdefault(categorize_doc(doc), []).append(doc)
+
+    counts = {}
+    totals = empty_stats()
+    for category, chunks in grouped.items():
+        embeddings = None
+        if model:
+            embeddings = model.encode([doc_text(chunk) for chunk in chunks])
+        stats = add_to_shard(category, chunks, embeddings, model_name)
+        counts[category] = stats["kept"]
+        add_stats(totals, stats)
+    return counts, totals
+
+
+def _load_centroid(category: str):
+    """Centroide normalizado de un shard (con caché por mtime), o None si no tiene."""
+    meta_path = _shard_path(category, SHARD_META_NAME)
+    if not os.path.exists(meta_path):
+        return None
+    mtime = os.path.getmtime(meta_path)
+    cached = _CENTROID_CACHE.get(category)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    import numpy as np
+    with open(meta_path, "rb") as f:
+        meta = pickle.load(f)
+    centroid = None
+    if meta.get("count"):
+        centroid = meta["sum"] / meta["count"]
+        norm = np.linalg.norm(centroid)
+        centroid = centroid / norm if norm else centroid
+    _CENTROID_CACHE[category] = (mtime, centroid)
+    return centroid
+
+
+def route_query(query: str, query_vec=None, fanout: bool = False):
+    """
+    Elige los shards a consultar. Usa similitud con los centroides si hay vector
+    de consulta, y si no, coincidencias de palabras clave. Si la consulta es
+    ambigua (sin señal, o más de ROUTER_MAX_SHARDS shards empatados con el mejor)
+    o fanout=True, devuelve todos los shards.
+    """
+    available = list_shards()
+    if fanout or len(available) <= 1:
+        return available
+
+    # Los shards sin centroide no se pueden puntuar por similitud: se consultan siempre
+    scores = {}
+    unscored = []
+    if query_vec is not None:
+        import numpy as np
+        vec = query_vec[0]
+        norm = np.linalg.norm(vec)
+        vec = vec / norm if norm else vec
+        for category in available:
+            centroid = _load_centroid(category)
+            if centroid is None:
+                unscored.append(category)
+            else:
+                scores[category] = float(np.dot(vec, centroid))
+    if query_vec is None or not scores:
+        unscored = []
+        keyword_scores = _keyword_scores(query)
+        scores = {category: keyword_scores.get(category, 0) for category in available}
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if ranked[0][1] <= 0:
+            return available
+        top_score = ranked[0][1]
+        selected = [category for category, score in ranked if score >= top_score * ROUTER_FANOUT_RATIO]
+    else:
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        top_score = ranked[0][1]
+        selected = [category for category, score in ranked if top_score - score <= ROUTER_CENTROID_MARGIN]
+
+    if len(selected) > ROUTER_MAX_SHARDS:
+        return available
+    return selected + unscored
+
+
+def load_shard(category: str):
+    """Carga (con caché) el índice y los documentos de un shard. El índice puede ser None."""
+    docs_path = _shard_path(category, SHARD_DOCS_NAME)
+    index_path = _shard_path(category, SHARD_INDEX_NAME)
+    mtime = max(
+        os.path.getmtime(path) for path in (docs_path, index_path) if os.path.exists(path)
+    )
+
+    cached = _SHARD_CACHE.get(category)
+    if cached and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    with open(docs_path, "rb") as f:
+        docs = pickle.load(f)
+    index = None
+    if os.path.exists(index_path):
+        try:
+            import faiss
+            index = faiss.read_index(index_path)
+        except ImportError:
+            pass
+
+    _SHARD_CACHE[category] = (mtime, index, docs)
+    return index, docs
+
+
+def search_shards(query_vec, categories, top_k=4):
+    """
+    Busca el vector de consulta en cada shard seleccionado y mezcla los resultados
+    por distancia. Devuelve una lista de (distancia, documento) ordenada.
+    """
+    results = []
+    for category in categories:
+        index, docs = load_shard(category)
+        if index is None or index.ntotal == 0:
+            continue
+        if query_vec.shape[1] != index.d:
+            raise ValueError("Dimension mismatch")
+        distances, indices = index.search(query_vec, min(top_k, index.ntotal))
+        for dist, i in zip(distances[0], indices[0]):
+            if i >= 0:
+                results.append((float(dist), docs[i]))
+    results.sort(key=lambda item: item[0])
+    return results[:top_k]
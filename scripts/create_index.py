@@ -2,17 +2,23 @@
 
 import os
 from app.services.embedding_service import build_vector_index
+from app.services.dedup_service import add_stats, empty_stats, format_dedup_report
 
 # Carpeta donde están los PDFs
 pdf_directory = os.getenv("PDF_SOURCE_PATH", "data/pdfs")
 
 # Función para procesar todos los PDFs en la carpeta
 def process_pdfs_in_directory(pdf_directory):
+    totals = empty_stats()
     for filename in os.listdir(pdf_directory):
         if filename.endswith(".pdf"):  # Solo procesamos los archivos .pdf
             pdf_path = os.path.join(pdf_directory, filename)
             print(f"Procesando el archivo: {pdf_path}")
-            build_vector_index(pdf_path)  # Llamamos a la función que procesa cada PDF
+            stats = build_vector_index(pdf_path)  # Llamamos a la función que procesa cada PDF
+            if stats:
+                add_stats(totals, stats)
+    # Cuánto se redujo el índice al eliminar duplicados
+    print(f"Total: {format_dedup_report(totals)}")
 
 # Llamamos a la función para procesar todos los PDFs en la carpeta
 process_pdfs_in_directory(pdf_directory)
@@ -0,0 +1,26 @@
+# /scripts/create_shards.py
+
+import os
+import pickle
+import sys
+from app.services.embedding_service import EMBEDDING_MODEL_NAME, MODEL
+from app.services.dedup_service import format_dedup_report
+from app.services.shard_service import build_shards_from_docs
+
+# Sin modelo de embeddings los shards quedarían sin vectores y no servirían para la búsqueda
+if MODEL is None:
+    sys.exit(f"❌ Modelo de embeddings '{EMBEDDING_MODEL_NAME}' no disponible. No se reconstruyen los shards.")
+
+# Archivo plano de fragmentos ya procesados
+doc_file = os.getenv("VECTOR_DB_DOCS", "data/vector_db/docs.pkl")
+
+# Reconstruye desde cero los shards por categoría a partir de los fragmentos existentes
+# (sin volver a leer los PDFs), con el mismo modelo de embeddings que usan las consultas
+with open(doc_file, "rb") as f:
+    docs = pickle.load(f)
+
+# Cada shard descarta sus propios duplicados
+counts, stats = build_shards_from_docs(docs, MODEL, EMBEDDING_MODEL_NAME)
+for category, count in sorted(counts.items()):
+    print(f"{category}: {count} fragmentos")
+print(format_dedup_report(stats))
@@ -0,0 +1,6 @@
+# /scripts/dedupe_index.py
+
+from app.services.embedding_service import dedupe_vector_index
+
+# Elimina los duplicados del índice plano existente (index.faiss + docs.pkl) sin volver a leer los PDFs
+dedupe_vector_index()
@@ -0,0 +1,67 @@
+# /scripts/stub_llm_servers.py
+
+# Levanta varios servidores locales que imitan /api/generate y /api/tags de Ollama,
+# para probar el pool de backends LLM sin GPU. Uso:
+#   python -m scripts.stub_llm_servers 11501:0.2 11502:1.0 11503:fail
+#   LLM_BACKENDS=http://localhost:11501/api/generate|stub|2,http://localhost:11502/api/generate|stub|2,...
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(port, delay, fail):
+    class StubHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if fail:
+                self._send(503, {"error": "stub caído"})
+            else:
+                self._send(200, {"models": [{"name": "stub"}]})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(delay)
+            if fail:
+                self._send(500, {"error": "stub caído"})
+                return
+            answer = (f"Respuesta del backend stub en el puerto {port} con el modelo {request.get('model')}. "
+                      "Mawell ofrece equipos y servicios industriales. ¿Puedo ayudarte con algo más?")
+            self._send(200, {"model": request.get("model"), "response": answer, "done": True})
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(specs):
+    servers = []
+    for spec in specs:
+        port, _, behaviour = spec.partition(":")
+        fail = behaviour == "fail"
+        delay = 0.0 if fail or not behaviour else float(behaviour)
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), make_handler(int(port), delay, fail))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        print(f"🧪 Stub LLM en http://localhost:{port}/api/generate ({'falla' if fail else f'{delay}s'})")
+    return servers
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1:] or ["11501:0.2", "11502:0.5"])
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass